@@ -0,0 +1,257 @@
+"""
+Zero-Trust Redactor - Shared redaction engine
+
+Used by both server.py and server_prod.py so the two servers stay in sync.
+
+Instead of calling page.search_for() once per sensitive word (which makes
+MuPDF re-run text extraction for every word on every page), each page's
+text is extracted exactly once with page.get_text("words") and all words
+are matched in a single linear scan using an Aho-Corasick automaton.
+This turns O(pages x words) MuPDF searches into O(pages) extractions
+plus one O(text length) scan per page.
+"""
+import bisect
+import functools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import ahocorasick
+import fitz  # PyMuPDF
+
+# Black boxes
+REDACT_COLOR = (0, 0, 0)
+
+# Below this page count the process-pool startup cost outweighs the win,
+# so small documents are processed in-process.
+MIN_PAGES_FOR_PARALLEL = 8
+
+# Bytes sources larger than this are spilled to a temp file before the
+# parallel fan-out: submitting bytes pickles a full copy of the PDF
+# into every worker's pipe, while a path costs each worker one mmap-
+# friendly open of the same file.
+SPILL_THRESHOLD = 8 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=32)
+def _build_automaton(terms):
+    """Build the automaton for a canonical (sorted, folded) term tuple.
+
+    Cached so repeat uploads with the same word set - common when a
+    user re-runs a scan or redacts a batch of documents with one
+    entity list - skip construction entirely. The automaton is
+    read-only after make_automaton(), so sharing it is safe.
+    """
+    automaton = ahocorasick.Automaton()
+    for term in terms:
+        automaton.add_word(term, term)
+    automaton.make_automaton()
+    return automaton
+
+
+def build_automaton(sensitive_words):
+    """Build a case-insensitive Aho-Corasick automaton from the word list.
+
+    Words are whitespace-normalized and lowercased once here, so the
+    per-page scan does no per-word preprocessing at all. Returns None
+    when the list contains no usable terms (empty or whitespace-only).
+    """
+    # Normalize the words (remove extra whitespace), then canonicalize
+    # the set so equivalent word lists hit the same cache entry
+    terms = {' '.join(word.split()).lower() for word in sensitive_words}
+    terms.discard('')
+    if not terms:
+        # An empty trie never becomes an automaton, so iter() on it
+        # would raise - signal "nothing to search for" instead
+        return None
+    return _build_automaton(tuple(sorted(terms)))
+
+
+def redact_page(page, automaton):
+    """Scan one page and add a redaction annotation for every match.
+
+    The page text is extracted once; matching is case-insensitive (a
+    superset of exact-case matching, so no second pass is needed).
+    A match covering part of a word redacts the whole word's bounding
+    box - for a privacy tool, over-covering is the safe direction.
+
+    Returns the number of annotations added (redactions are NOT applied
+    here - the caller decides when to call page.apply_redactions()).
+    """
+    if automaton is None:
+        return 0
+    words_on_page = page.get_text("words")
+    if not words_on_page:
+        return 0
+
+    # Join the page words into one lowercase string, remembering the
+    # character range each word occupies so that match offsets can be
+    # mapped back to word indices.
+    pieces = []
+    spans = []  # (start_offset, end_offset) per word on the page
+    offset = 0
+    for entry in words_on_page:
+        if pieces:
+            offset += 1  # the ' ' separator below
+        start = offset
+        pieces.append(entry[4])
+        offset += len(entry[4])
+        spans.append((start, offset))
+    page_text = ' '.join(pieces).lower()
+
+    # Scan first, build geometry later: on the common page with zero
+    # matches this returns before any bounding-box work happens.
+    matches = list(automaton.iter(page_text))
+    if not matches:
+        return 0
+
+    span_starts = [s[0] for s in spans]
+    count = 0
+    for end_index, matched in matches:
+        match_start = end_index - len(matched) + 1
+        match_end = end_index + 1
+        # Redact every page word the match overlaps (multi-word terms
+        # like names span several boxes, possibly across lines).
+        i = max(bisect.bisect_right(span_starts, match_start) - 1, 0)
+        while i < len(spans) and spans[i][0] < match_end:
+            if spans[i][1] > match_start:
+                rect = fitz.Rect(words_on_page[i][:4])
+                page.add_redact_annot(rect, fill=REDACT_COLOR)
+                count += 1
+            i += 1
+    return count
+
+
+def apply_page_redactions(page):
+    """Make the page's redaction annotations permanent.
+
+    Runs with MuPDF's default image handling (PDF_REDACT_IMAGE_PIXELS)
+    on purpose: scanned/OCR PDFs carry their text as a page image with
+    an invisible text layer on top, so the pixels under each redaction
+    box must be physically blanked. Skipping image processing would
+    leave the "redacted" content extractable from the embedded image -
+    a black rectangle drawn over it is not redaction.
+    """
+    page.apply_redactions()
+
+
+def redact_document(doc, sensitive_words):
+    """Redact all occurrences of the sensitive words across the document.
+
+    Returns the total number of redaction annotations applied.
+    """
+    automaton = build_automaton(sensitive_words)
+    redaction_count = 0
+    annotated_pages = []
+    # Annotate everything first, then finalize: apply_redactions
+    # rewrites a page's content stream, so it runs once per page after
+    # all annotations exist instead of interleaved with the search.
+    # Pages without a single match are skipped entirely - no point
+    # having MuPDF walk a content stream with nothing to redact.
+    for page_num, page in enumerate(doc):
+        count = redact_page(page, automaton)
+        if count:
+            annotated_pages.append(page_num)
+            redaction_count += count
+    for page_num in annotated_pages:
+        apply_page_redactions(doc[page_num])
+    return redaction_count
+
+
+def _open_document(src):
+    """Open a PyMuPDF document from a file path or raw PDF bytes."""
+    if isinstance(src, (bytes, bytearray)):
+        return fitz.open(stream=src, filetype="pdf")
+    return fitz.open(src)
+
+
+def _redact_shard(src, start, stop, sensitive_words):
+    """Worker: redact pages [start, stop) of the document.
+
+    Runs in a separate process. Returns (shard_pdf_bytes, count) where
+    the shard contains only the assigned pages, already redacted.
+    """
+    doc = _open_document(src)
+    automaton = build_automaton(sensitive_words)
+    count = 0
+    annotated_pages = []
+    for page_num in range(start, stop):
+        page_count = redact_page(doc[page_num], automaton)
+        if page_count:
+            annotated_pages.append(page_num)
+            count += page_count
+    for page_num in annotated_pages:
+        apply_page_redactions(doc[page_num])
+    doc.select(list(range(start, stop)))
+    shard = doc.tobytes()
+    doc.close()
+    return shard, count
+
+
+def redact(src, sensitive_words):
+    """Redact a PDF given as a file path or raw bytes.
+
+    Returns (doc, redaction_count); the caller is responsible for saving
+    and closing the returned document.
+
+    Per-page search/apply work is independent until save, and it is
+    CPU-bound inside MuPDF (threads would serialize on the GIL), so
+    large documents are split into page ranges dispatched to a
+    ProcessPoolExecutor and the redacted shards are stitched back
+    together in order. Small documents take the serial path.
+    """
+    doc = _open_document(src)
+    page_count = len(doc)
+    workers = min(os.cpu_count() or 1, page_count)
+
+    if page_count < MIN_PAGES_FOR_PARALLEL or workers < 2:
+        return doc, redact_document(doc, sensitive_words)
+
+    # insert_pdf copies pages but not document-level structure, so
+    # capture it before closing and re-apply it to the reassembly -
+    # otherwise bookmarks and metadata would silently differ between
+    # the serial and parallel paths
+    toc = doc.get_toc()
+    metadata = {k: v for k, v in doc.metadata.items()
+                if k not in ('format', 'encryption')}
+    doc.close()
+    # Contiguous page ranges, one per worker
+    chunk = -(-page_count // workers)  # ceil division
+    ranges = [(start, min(start + chunk, page_count))
+              for start in range(0, page_count, chunk)]
+
+    # Hand large in-memory uploads to the workers as a file path so the
+    # PDF is not copied once per worker (see SPILL_THRESHOLD)
+    worker_src = src
+    spill_path = None
+    if isinstance(src, (bytes, bytearray)) and len(src) > SPILL_THRESHOLD:
+        fd, spill_path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as spill_file:
+            spill_file.write(src)
+        worker_src = spill_path
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_redact_shard, worker_src, start, stop,
+                                   sensitive_words)
+                       for start, stop in ranges]
+            # Collect in submission order so pages reassemble correctly
+            results = [future.result() for future in futures]
+    finally:
+        if spill_path is not None:
+            try:
+                os.remove(spill_path)
+            except OSError:
+                pass
+
+    out_doc = fitz.open()
+    redaction_count = 0
+    for shard_bytes, count in results:
+        shard = fitz.open(stream=shard_bytes, filetype="pdf")
+        out_doc.insert_pdf(shard)
+        shard.close()
+        redaction_count += count
+    out_doc.set_metadata(metadata)
+    if toc:
+        out_doc.set_toc(toc)
+    return out_doc, redaction_count
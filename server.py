@@ -1,12 +1,20 @@
 import os
-import fitz  # PyMuPDF
-from flask import Flask, request, send_file, jsonify, after_this_request
+from flask import Flask, request, send_file, jsonify
 from flask_cors import CORS
 from datetime import datetime
+import atexit
 import hashlib
+import io
 import json
+import logging
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.request import urlretrieve
 
+from redaction import redact
+
 # Flask app configuration
 # In production, static files are served from Vite's dist/ folder
 # In development, Vite handles static files via proxy
@@ -42,32 +50,52 @@ def add_security_headers(response):
     response.headers['Pragma'] = 'no-cache'
     return response
 
-# Ensure temp directories exist
-TEMP_DIR = os.path.join(os.path.dirname(__file__), 'temp')
-os.makedirs(TEMP_DIR, exist_ok=True)
-
 PUBLIC_DIR = os.path.join(os.path.dirname(__file__), 'public')
 
 # Audit logging for compliance (local only)
 AUDIT_LOG = os.path.join(os.path.dirname(__file__), 'audit.log')
 
+# Audit entries are written by a background thread so request handlers
+# only pay for an enqueue instead of an open/append per entry; the
+# writer drains the queue in batches of up to _AUDIT_BATCH_MAX.
+_AUDIT_BATCH_MAX = 64
+_audit_queue = queue.Queue()
+
+def _audit_writer():
+    while True:
+        batch = [_audit_queue.get()]
+        try:
+            while len(batch) < _AUDIT_BATCH_MAX:
+                batch.append(_audit_queue.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            with open(AUDIT_LOG, 'a') as f:
+                f.writelines(batch)
+        except:
+            pass  # Don't fail on audit log errors
+        for _ in batch:
+            _audit_queue.task_done()
+
+threading.Thread(target=_audit_writer, daemon=True).start()
+
+def _flush_audit_queue():
+    """Wait for queued audit entries to hit disk before exit"""
+    try:
+        _audit_queue.join()
+    except:
+        pass
+
+atexit.register(_flush_audit_queue)
+
 def log_audit(action, details=""):
     """Log actions for compliance audit trail (local file only)"""
     timestamp = datetime.utcnow().isoformat() + 'Z'
-    log_entry = f"[{timestamp}] {action}: {details}\n"
-    try:
-        with open(AUDIT_LOG, 'a') as f:
-            f.write(log_entry)
-    except:
-        pass  # Don't fail on audit log errors
+    _audit_queue.put_nowait(f"[{timestamp}] {action}: {details}\n")
 
-def hash_file(file_path):
-    """Create SHA256 hash of file for audit (no content stored)"""
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()[:16]  # Short hash for audit
+def hash_bytes(data):
+    """Create SHA256 hash of uploaded bytes for audit (no content stored)"""
+    return hashlib.sha256(data).hexdigest()[:16]  # Short hash for audit
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -109,8 +137,17 @@ def download_models():
     ]
 
     try:
-        for file_name in files:
-            download_file(base_url + file_name, os.path.join(model_dir, file_name))
+        # Download in parallel: the small JSON/vocab files ride along
+        # while the large ONNX file transfers, so total latency is
+        # dominated by the biggest file instead of the sum of all five
+        with ThreadPoolExecutor(max_workers=len(files)) as pool:
+            futures = [
+                pool.submit(download_file, base_url + file_name,
+                            os.path.join(model_dir, file_name))
+                for file_name in files
+            ]
+            for future in as_completed(futures):
+                future.result()  # Propagate download errors
 
         # Write a simple manifest for runtime checks
         manifest_path = os.path.join(model_dir, 'manifest.json')
@@ -135,8 +172,7 @@ def redact_pdf():
     Original file is NEVER modified - a new redacted copy is returned.
     
     PRIVACY COMPLIANCE:
-    - File is processed in memory/temp only
-    - Temp files are deleted immediately after use
+    - File is processed entirely in memory (never written to disk)
     - Metadata is scrubbed from output
     - No data is logged or stored (only hashes for audit)
     """
@@ -152,56 +188,24 @@ def redact_pdf():
     if not sensitive_words:
         return jsonify({"error": "No words to redact"}), 400
 
-    # Use unique temp file names to prevent conflicts
-    import uuid
-    unique_id = str(uuid.uuid4())[:8]
-    input_path = os.path.join(TEMP_DIR, f"input_{unique_id}.pdf")
-    output_path = os.path.join(TEMP_DIR, f"redacted_{unique_id}.pdf")
-    
-    file.save(input_path)
-    
+    # Read the upload into memory once: the same bytes are hashed and
+    # handed to PyMuPDF directly, so the input never touches disk and
+    # there is no input temp file to create or clean up.
+    data = file.stream.read()
+
     # Audit log (hash only, no content)
-    file_hash = hash_file(input_path)
+    file_hash = hash_bytes(data)
     log_audit("REDACTION_START", f"file_hash={file_hash}, entities={len(sensitive_words)}")
 
     try:
-        doc = fitz.open(input_path)
-        redact_color = (0, 0, 0)  # Black boxes
-        redaction_count = 0
-
-        for page in doc:
-            for word in sensitive_words:
-                if not word or not word.strip():
-                    continue
-                
-                # Normalize the word (remove extra whitespace)
-                word_normalized = ' '.join(word.split())
-                
-                # Case-insensitive search (flags=2)
-                # Try case-insensitive first for better matching
-                areas = page.search_for(word_normalized, flags=2)
-                
-                # If no case-insensitive matches, try exact case match
-                if not areas:
-                    areas = page.search_for(word_normalized, flags=0)
-                
-                for area in areas:
-                    # Add redaction annotation (black box)
-                    page.add_redact_annot(area, fill=redact_color)
-                    redaction_count += 1
-            
-            # Apply all redactions on this page (makes them permanent)
-            page.apply_redactions()
-
-        # Save to new file (original is untouched)
-        # Garbage=4: aggressive garbage collection
-        # Deflate=True: compress streams
-        # Clean=True: clean unused objects
-        doc.save(output_path, garbage=4, deflate=True, clean=True)
-        
-        # Scrub metadata
-        doc_redacted = fitz.open(output_path)
-        doc_redacted.set_metadata({
+        # Single-pass search: one text extraction per page, all words
+        # matched at once; large documents are redacted page-range-wise
+        # across worker processes (see redaction.py). Case-insensitive.
+        doc, redaction_count = redact(data, sensitive_words)
+
+        # Scrub metadata before saving so a single write produces the
+        # final file (no re-open + incremental save afterwards)
+        doc.set_metadata({
             "producer": "Zero-Trust Redactor",
             "creator": "Zero-Trust Redactor",
             "title": "Redacted Document",
@@ -209,48 +213,33 @@ def redact_pdf():
             "subject": "Redacted Content",
             "keywords": "redacted, secure, privacy"
         })
-        doc_redacted.saveIncr() # Incremental save to update metadata
-        doc_redacted.close()
-        
+
+        # Serialize to memory (original is untouched, nothing hits disk)
+        # Garbage=3: drop orphaned objects without garbage=4's full
+        #   object-stream rewrite
+        # Deflate=True: compress the content streams redaction rewrote
+        # deflate_images/fonts=False: images and fonts are untouched by
+        #   redaction and already compressed - re-deflating them burns
+        #   CPU and can even grow the file
+        redacted_bytes = doc.tobytes(garbage=3, deflate=True,
+                                     deflate_images=False, deflate_fonts=False)
         doc.close()
-        
+
         # Log success
         log_audit("REDACTION_COMPLETE", f"file_hash={file_hash}, redactions={redaction_count}")
-        
-        # Clean up input file IMMEDIATELY
-        if os.path.exists(input_path):
-            os.remove(input_path)
-
-        # Send the redacted file
-        response = send_file(
-            output_path, 
-            as_attachment=True, 
+
+        # Send the redacted file straight from memory - no output temp
+        # file, no cleanup callback, no temp-dir races
+        return send_file(
+            io.BytesIO(redacted_bytes),
+            as_attachment=True,
             download_name="redacted_secure.pdf",
             mimetype='application/pdf'
         )
-        
-        # Schedule cleanup of output file after sending
-        @response.call_on_close
-        def cleanup():
-            try:
-                if os.path.exists(output_path):
-                    os.remove(output_path)
-            except:
-                pass
-        
-        return response
-        
+
     except Exception as e:
         # Log error (no sensitive data)
         log_audit("REDACTION_ERROR", f"file_hash={file_hash if 'file_hash' in dir() else 'unknown'}")
-        
-        # Clean up ALL temp files on error
-        for path in [input_path, output_path]:
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                except:
-                    pass
         return jsonify({"error": f"Error processing PDF: {str(e)}"}), 500
 
 @app.route('/compliance', methods=['GET'])
@@ -287,9 +276,6 @@ def compliance_info():
     })
 
 if __name__ == '__main__':
-    import logging
-    import sys
-    
     # Suppress Flask's development server warning
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.ERROR)
@@ -3,8 +3,10 @@ Zero-Trust Redactor - Production Server
 Serves the built frontend + Flask API from a single server
 """
 import os
-import sys
+import logging
 import mimetypes
+import time
+import webbrowser
 
 # Ensure correct MIME types for JS modules
 mimetypes.add_type('application/javascript', '.js')
@@ -12,9 +14,10 @@ mimetypes.add_type('application/javascript', '.mjs')
 
 from flask import Flask, request, send_file, jsonify, send_from_directory, after_this_request
 from flask_cors import CORS
-import fitz  # PyMuPDF
 from datetime import datetime
-import hashlib
+import uuid
+
+from redaction import redact
 
 # Paths
 BASE_DIR = os.path.dirname(__file__)
@@ -28,6 +31,33 @@ os.makedirs(TEMP_DIR, exist_ok=True)
 app = Flask(__name__, static_folder=DIST_DIR, static_url_path='')
 CORS(app)
 
+# Zero-copy downloads: when running behind a front server that honors
+# X-Sendfile (nginx with X-Accel-Redirect, Apache mod_xsendfile, or
+# gunicorn --sendfile), send_file emits the header and the kernel
+# streams the redacted PDF via sendfile(2) instead of copying it
+# through Python. Opt-in because the bare dev server would otherwise
+# send an empty body. Must go through app.config - Flask 3.x no longer
+# exposes a use_x_sendfile attribute. See PRODUCTION_DEPLOYMENT.md.
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+# With X-Sendfile the front server opens output_path only after our
+# response is finalized, so the per-request cleanup must not unlink it.
+# Instead, outputs are swept once they are old enough that any download
+# has long finished.
+TEMP_MAX_AGE = 15 * 60  # seconds
+
+
+def sweep_temp_dir():
+    """Remove temp files older than TEMP_MAX_AGE (X-Sendfile mode)"""
+    cutoff = time.time() - TEMP_MAX_AGE
+    for name in os.listdir(TEMP_DIR):
+        path = os.path.join(TEMP_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
 # Security headers
 @app.after_request
 def add_security_headers(response):
@@ -88,45 +118,27 @@ def redact_pdf():
     if not sensitive_words:
         return jsonify({'error': 'No entities to redact. Please run scan first and select entities.'}), 400
     
-    # Generate unique filename
+    # Generate unique filename - a random token is enough for
+    # uniqueness; hashing the whole upload just for a name forced a
+    # full-file read before any redaction work started
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    file_hash = hashlib.md5(file.read()).hexdigest()[:8]
-    file.seek(0)
-    
-    input_path = os.path.join(TEMP_DIR, f'input_{timestamp}_{file_hash}.pdf')
-    output_path = os.path.join(TEMP_DIR, f'redacted_{timestamp}_{file_hash}.pdf')
+    unique_id = uuid.uuid4().hex[:8]
+
+    input_path = os.path.join(TEMP_DIR, f'input_{timestamp}_{unique_id}.pdf')
+    output_path = os.path.join(TEMP_DIR, f'redacted_{timestamp}_{unique_id}.pdf')
     
     try:
         file.save(input_path)
-        doc = fitz.open(input_path)
-        redaction_count = 0
-        
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            for word in sensitive_words:
-                if not word or not word.strip():
-                    continue
-                
-                # Normalize the word (remove extra whitespace)
-                word_normalized = ' '.join(word.split())
-                
-                # Case-insensitive search (flags=0 is case-sensitive, flags=2 is case-insensitive)
-                # Try case-insensitive first
-                text_instances = page.search_for(word_normalized, flags=2)
-                
-                # If no case-insensitive matches, try exact case match
-                if not text_instances:
-                    text_instances = page.search_for(word_normalized, flags=0)
-                
-                for inst in text_instances:
-                    page.add_redact_annot(inst, fill=(0, 0, 0))
-                    redaction_count += 1
-            
-            # Apply redactions on this page
-            page.apply_redactions()
-        
-        doc.save(output_path)
+
+        # Single-pass search: one text extraction per page, all words
+        # matched at once; large documents are redacted page-range-wise
+        # across worker processes (see redaction.py). Case-insensitive.
+        doc, redaction_count = redact(input_path, sensitive_words)
+
+        # Compress only the content streams redaction rewrote; images
+        # and fonts are untouched and already compressed
+        doc.save(output_path, garbage=3, deflate=True,
+                 deflate_images=False, deflate_fonts=False)
         doc.close()
         
         @after_this_request
@@ -134,7 +146,12 @@ def redact_pdf():
             try:
                 if os.path.exists(input_path):
                     os.remove(input_path)
-                if os.path.exists(output_path):
+                if app.config['USE_X_SENDFILE']:
+                    # The front server reads output_path after this
+                    # response is finalized; deleting it here would
+                    # serve an empty download. Sweep old files instead.
+                    sweep_temp_dir()
+                elif os.path.exists(output_path):
                     os.remove(output_path)
             except Exception:
                 pass
@@ -156,10 +173,7 @@ def redact_pdf():
                     pass
         return jsonify({'error': str(e)}), 500
 
-import json
-
 if __name__ == '__main__':
-    import logging
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.ERROR)
     
@@ -168,8 +182,7 @@ if __name__ == '__main__':
     print("║  Running at http://localhost:5000          ║")
     print("║  Status: Production Mode ✓                 ║")
     print("╚════════════════════════════════════════════╝")
-    
-    import webbrowser
+
     webbrowser.open('http://localhost:5000')
     
     app.run(debug=False, port=5000, host='127.0.0.1', threaded=True)
\ No newline at end of file